@@ -3,71 +3,91 @@ Audio Analysis Service using librosa
 Provides intensity curves, BPM/Key detection, and peak segment detection
 """
 
+import os
+import functools
 import librosa
 import numpy as np
+from joblib import Parallel, delayed
 from pathlib import Path
 from typing import List, Dict, Any, Optional
 import logging
 
 logger = logging.getLogger("AudioAnalysis")
 
+
+def _zscore(x: np.ndarray, axis: int = -1) -> np.ndarray:
+    """Standardize to zero mean / unit variance along axis (constant input maps to 0)"""
+    return (x - x.mean(axis=axis, keepdims=True)) / (x.std(axis=axis, keepdims=True) + 1e-12)
+
+
+# Key names
+_KEY_NAMES = ('C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B')
+
+# Major and minor profiles (Krumhansl-Schmuckler), z-scored once at import
+_MAJOR_Z = _zscore(np.array([6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88], dtype=np.float32))
+_MINOR_Z = _zscore(np.array([6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17], dtype=np.float32))
+_PROFILES_Z = np.stack([_MAJOR_Z, _MINOR_Z])
+
+# Circulant index matrix: _ROTATION_INDEX[i, j] == (i + j) % 12
+_ROTATION_INDEX = (np.arange(12)[:, None] + np.arange(12)[None, :]) % 12
+
+
+def _scan_segments(mask: np.ndarray, values: np.ndarray, times: np.ndarray, min_duration: float):
+    """
+    Run-length scan over a boolean frame mask.
+    A run ends at the first frame below threshold, or at the last frame.
+    
+    Returns (start_times, end_times, mean values) of runs lasting at least min_duration.
+    """
+    edges = np.diff(mask.astype(np.int8), prepend=0, append=0)
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    
+    start_times = times[starts]
+    end_times = times[np.minimum(ends, len(times) - 1)]
+    
+    # Mean value of each run via prefix sums (kept in float64: long float32 cumsums drift)
+    csum = np.concatenate(([0.0], np.cumsum(values, dtype=np.float64)))
+    means = (csum[ends] - csum[starts]) / (ends - starts)
+    
+    keep = (end_times - start_times) >= min_duration
+    return start_times[keep], end_times[keep], means[keep]
+
+
 class AudioAnalyzer:
-    def __init__(self, sr: int = 22050):
+    def __init__(self, sr: int = 22050, feature_sr: int = 11025):
+        # sr is used for BPM detection (tempo accuracy depends on it);
+        # RMS/chroma are computed on a signal resampled to feature_sr
         self.sr = sr
+        self.feature_sr = feature_sr
+        self.n_fft = 2048
     
-    def analyze(self, audio_path: str, hop_length: int = 512) -> Dict[str, Any]:
+    def analyze(
+        self,
+        audio_path: str,
+        hop_length: int = 512,
+        duration_max_sec: float = 480.0
+    ) -> Dict[str, Any]:
         """
         Comprehensive audio analysis
         
         Returns:
-            - intensity_curve: RMS energy over time (normalized 0-1)
+            - intensity_curve: RMS energy over time (normalized 0-1) as {"times": [...], "values": [...]}
             - bpm: Estimated tempo
             - key: Estimated musical key
             - segments: Detected peak/climax regions
             - duration: Total duration in seconds
+            - truncated: True if only the first duration_max_sec seconds were analyzed
+        
+        Results are cached per (path, mtime, size, hop_length, duration_max_sec), so
+        repeated requests for an unchanged file skip the librosa pipeline entirely.
         """
         try:
-            # Load audio
-            y, sr = librosa.load(audio_path, sr=self.sr)
-            duration = librosa.get_duration(y=y, sr=sr)
-            
-            # RMS Energy (Intensity Curve)
-            rms = librosa.feature.rms(y=y, hop_length=hop_length)[0]
-            rms_normalized = (rms - rms.min()) / (rms.max() - rms.min() + 1e-6)
-            
-            # Convert frame indices to time
-            times = librosa.frames_to_time(np.arange(len(rms)), sr=sr, hop_length=hop_length)
-            
-            # Downsample for frontend (max ~500 points)
-            max_points = 500
-            if len(times) > max_points:
-                indices = np.linspace(0, len(times) - 1, max_points, dtype=int)
-                times = times[indices]
-                rms_normalized = rms_normalized[indices]
-            
-            intensity_curve = [
-                {"time": float(t), "value": float(v)} 
-                for t, v in zip(times, rms_normalized)
-            ]
-            
-            # BPM Detection
-            tempo, _ = librosa.beat.beat_track(y=y, sr=sr)
-            bpm = float(tempo) if isinstance(tempo, (int, float, np.number)) else float(tempo[0])
-            
-            # Key Detection (Chroma-based)
-            key = self._detect_key(y, sr)
-            
-            # Peak Segment Detection
-            segments = self._detect_peak_segments(rms, sr, hop_length, duration)
-            
-            return {
-                "success": True,
-                "duration": duration,
-                "bpm": round(bpm, 1),
-                "key": key,
-                "intensity_curve": intensity_curve,
-                "segments": segments
-            }
+            stat = os.stat(audio_path)
+            result = self._analyze_cached(
+                audio_path, stat.st_mtime_ns, stat.st_size, hop_length, duration_max_sec
+            )
+            return dict(result)
             
         except Exception as e:
             logger.error(f"Audio analysis failed: {e}")
@@ -76,49 +96,124 @@ class AudioAnalyzer:
                 "error": str(e)
             }
     
-    def _detect_key(self, y: np.ndarray, sr: int) -> str:
-        """Detect musical key using chroma features"""
+    def analyze_many(self, audio_paths: List[str], n_jobs: Optional[int] = None, **kwargs) -> List[Dict[str, Any]]:
+        """
+        Analyze several files in parallel worker processes.
+        librosa's DSP still holds the GIL for much of its Python-level work, so processes
+        scale where threads would not. Results are returned in the order of audio_paths.
+        """
+        if n_jobs is None:
+            n_jobs = max(1, (os.cpu_count() or 2) // 2)
+        if n_jobs == 1 or len(audio_paths) <= 1:
+            return [self.analyze(p, **kwargs) for p in audio_paths]
+        return Parallel(n_jobs=n_jobs, backend="loky")(
+            delayed(self.analyze)(p, **kwargs) for p in audio_paths
+        )
+    
+    def cache_clear(self) -> None:
+        """Drop all cached analysis results"""
+        self._analyze_cached.cache_clear()
+    
+    @functools.lru_cache(maxsize=16)
+    def _analyze_cached(
+        self,
+        audio_path: str,
+        mtime_ns: int,
+        size: int,
+        hop_length: int,
+        duration_max_sec: float
+    ) -> Dict[str, Any]:
+        """Run the full analysis; mtime_ns/size only serve as cache key so edits invalidate it"""
+        # Bound the worst-case work: read the length from the file header (no decode)
+        # and only load the first duration_max_sec seconds
+        duration = librosa.get_duration(path=audio_path)
+        truncated = duration > duration_max_sec
+        
+        # Load audio
+        y, sr = librosa.load(audio_path, sr=self.sr, dtype=np.float32, offset=0.0, duration=duration_max_sec)
+        
+        # Downsampled signal for intensity/key features
+        # hop is scaled so that frame timing matches hop_length at sr
+        feature_sr = self.feature_sr
+        y_lo = librosa.resample(y, orig_sr=sr, target_sr=feature_sr)
+        feature_hop = max(1, int(round(hop_length * feature_sr / sr)))
+        
+        # One magnitude STFT shared by all frame-based features
+        S = np.abs(librosa.stft(y_lo, n_fft=self.n_fft, hop_length=feature_hop))
+        
+        # RMS Energy (Intensity Curve)
+        rms = librosa.feature.rms(S=S, frame_length=self.n_fft, hop_length=feature_hop, dtype=np.float32)[0]
+        rms_normalized = (rms - rms.min()) / (rms.max() - rms.min() + 1e-6)
+        
+        # Convert frame indices to time (shared with peak segment detection)
+        frame_times = librosa.frames_to_time(np.arange(len(rms)), sr=feature_sr, hop_length=feature_hop).astype(np.float32)
+        
+        # Downsample for frontend (max ~500 points)
+        max_points = 500
+        times = frame_times
+        values = rms_normalized
+        if len(times) > max_points:
+            indices = np.linspace(0, len(times) - 1, max_points, dtype=int)
+            times = frame_times[indices]
+            values = rms_normalized[indices]
+        
+        # Parallel arrays, rounded in NumPy (smaller JSON, no per-point dicts)
+        # Round in float64 so the float32 features serialize as short decimals
+        intensity_curve = {
+            "times": np.round(times.astype(np.float64), 3).tolist(),
+            "values": np.round(values.astype(np.float64), 4).tolist()
+        }
+        
+        # BPM Detection
+        # Only the global tempo is needed, so skip beat_track's dynamic-programming beat picking
+        # and estimate tempo directly from the onset envelope
+        onset_env = librosa.onset.onset_strength(y=y, sr=sr, hop_length=hop_length)
+        tempo = librosa.feature.tempo(onset_envelope=onset_env, sr=sr, hop_length=hop_length)
+        bpm = float(tempo[0])
+        
+        # Key Detection (Chroma-based)
+        key = self._detect_key(S, feature_sr)
+        
+        # Peak Segment Detection
+        segments = self._detect_peak_segments(rms_normalized, frame_times)
+        
+        return {
+            "success": True,
+            "duration": duration,
+            "bpm": round(bpm, 1),
+            "key": key,
+            "intensity_curve": intensity_curve,
+            "segments": segments,
+            "truncated": truncated
+        }
+    
+    def _detect_key(self, S: np.ndarray, sr: int) -> str:
+        """Detect musical key using chroma features of a magnitude spectrogram"""
         try:
             # Compute chroma features
-            chroma = librosa.feature.chroma_cqt(y=y, sr=sr)
-            chroma_mean = np.mean(chroma, axis=1)
-            
-            # Key names
-            key_names = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+            # STFT chroma reuses the shared spectrogram and is much cheaper than chroma_cqt;
+            # its coarser low-frequency resolution barely affects the mean chroma used here
+            chroma = librosa.feature.chroma_stft(S=S**2, sr=sr, n_fft=self.n_fft)
+            chroma_mean = chroma.mean(axis=1, dtype=np.float32)
             
-            # Major and minor profiles (Krumhansl-Schmuckler)
-            major_profile = np.array([6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88])
-            minor_profile = np.array([6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17])
+            # Rotate chroma to match every key at once: rotated[i] == np.roll(chroma_mean, -i)
+            rotated_z = _zscore(chroma_mean[_ROTATION_INDEX])
             
-            # Correlate with each possible key
-            max_corr = -1
-            best_key = "C major"
+            # Pearson correlation of each rotation with each profile -> (12, 2)
+            corrs = rotated_z @ _PROFILES_Z.T / 12
             
-            for i in range(12):
-                # Rotate chroma to match key
-                rotated = np.roll(chroma_mean, -i)
-                
-                major_corr = np.corrcoef(rotated, major_profile)[0, 1]
-                minor_corr = np.corrcoef(rotated, minor_profile)[0, 1]
-                
-                if major_corr > max_corr:
-                    max_corr = major_corr
-                    best_key = f"{key_names[i]} major"
-                if minor_corr > max_corr:
-                    max_corr = minor_corr
-                    best_key = f"{key_names[i]} minor"
-            
-            return best_key
+            # First maximum in (key, mode) order, same tie-breaking as the sequential scan
+            key_idx, mode_idx = np.unravel_index(np.argmax(corrs), corrs.shape)
+            mode = "major" if mode_idx == 0 else "minor"
+            return f"{_KEY_NAMES[key_idx]} {mode}"
         except Exception as e:
             logger.warning(f"Key detection failed: {e}")
             return "Unknown"
     
     def _detect_peak_segments(
         self, 
-        rms: np.ndarray, 
-        sr: int, 
-        hop_length: int,
-        duration: float,
+        rms_norm: np.ndarray, 
+        times: np.ndarray,
         threshold_percentile: float = 75,
         min_duration: float = 5.0,
         max_segments: int = 5
@@ -126,6 +221,9 @@ class AudioAnalyzer:
         """
         Detect peak/climax segments in the audio
         
+        rms_norm is the min-max normalized (0-1) RMS envelope and
+        times holds the time in seconds of each of its frames.
+        
         Returns list of segments with:
         - start: Start time in seconds
         - end: End time in seconds
@@ -133,60 +231,32 @@ class AudioAnalyzer:
         - label: Human-readable label
         """
         try:
-            # Normalize RMS
-            rms_norm = (rms - rms.min()) / (rms.max() - rms.min() + 1e-6)
-            
             # Find threshold
             threshold = np.percentile(rms_norm, threshold_percentile)
             
             # Find regions above threshold
             above_threshold = rms_norm >= threshold
             
-            # Convert to time
-            times = librosa.frames_to_time(np.arange(len(rms)), sr=sr, hop_length=hop_length)
-            
             # Find contiguous regions
-            segments = []
-            in_segment = False
-            start_idx = 0
+            start_times, end_times, avg_intensities = _scan_segments(above_threshold, rms_norm, times, min_duration)
             
-            for i, above in enumerate(above_threshold):
-                if above and not in_segment:
-                    in_segment = True
-                    start_idx = i
-                elif not above and in_segment:
-                    in_segment = False
-                    end_idx = i
-                    
-                    start_time = times[start_idx]
-                    end_time = times[end_idx]
-                    seg_duration = end_time - start_time
-                    
-                    if seg_duration >= min_duration:
-                        avg_intensity = float(np.mean(rms_norm[start_idx:end_idx]))
-                        segments.append({
-                            "start": round(start_time, 2),
-                            "end": round(end_time, 2),
-                            "intensity": round(avg_intensity, 2),
-                            "label": self._get_intensity_label(avg_intensity)
-                        })
+            # Take top N by intensity (partial selection, then sort only those N)
+            if len(avg_intensities) > max_segments:
+                top_idx = np.sort(np.argpartition(-avg_intensities, max_segments)[:max_segments])
+            else:
+                top_idx = np.arange(len(avg_intensities))
+            top_idx = top_idx[np.argsort(-avg_intensities[top_idx], kind="stable")]
             
-            # Handle segment at end
-            if in_segment:
-                end_time = times[-1]
-                start_time = times[start_idx]
-                if end_time - start_time >= min_duration:
-                    avg_intensity = float(np.mean(rms_norm[start_idx:]))
-                    segments.append({
-                        "start": round(start_time, 2),
-                        "end": round(end_time, 2),
-                        "intensity": round(avg_intensity, 2),
-                        "label": self._get_intensity_label(avg_intensity)
-                    })
-            
-            # Sort by intensity and take top N
-            segments.sort(key=lambda x: x["intensity"], reverse=True)
-            return segments[:max_segments]
+            segments = []
+            for i in top_idx:
+                avg_intensity = float(avg_intensities[i])
+                segments.append({
+                    "start": round(float(start_times[i]), 2),
+                    "end": round(float(end_times[i]), 2),
+                    "intensity": round(avg_intensity, 2),
+                    "label": self._get_intensity_label(avg_intensity)
+                })
+            return segments
             
         except Exception as e:
             logger.warning(f"Peak detection failed: {e}")
@@ -205,10 +275,6 @@ class AudioAnalyzer:
 
 
 # Singleton instance
-_analyzer: Optional[AudioAnalyzer] = None
-
+@functools.lru_cache(maxsize=1)
 def get_analyzer() -> AudioAnalyzer:
-    global _analyzer
-    if _analyzer is None:
-        _analyzer = AudioAnalyzer()
-    return _analyzer
+    return AudioAnalyzer()
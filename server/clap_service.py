@@ -3,45 +3,74 @@ CLAP (Contrastive Language-Audio Pretraining) Service
 Enables natural language search for audio segments
 """
 
+import os
+import contextlib
+import functools
 import logging
+import threading
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 import librosa
 
 logger = logging.getLogger("CLAPService")
 
 # Global model instance (lazy loaded)
 _clap_model = None
-_model_loading = False
+_model_lock = threading.Lock()     # Serializes loading; released on failure so later calls retry
+_model_ready = threading.Event()   # Set once the model is loaded
 
-def get_clap_model():
-    """Lazy load CLAP model to avoid startup delays"""
-    global _clap_model, _model_loading
+def get_clap_model(timeout: float = 300.0):
+    """
+    Lazy load CLAP model to avoid startup delays.
+    Concurrent callers wait (up to timeout seconds) for an in-flight load instead of getting None.
+    """
+    global _clap_model
     
-    if _clap_model is not None:
+    if _model_ready.is_set():
         return _clap_model
     
-    if _model_loading:
+    if not _model_lock.acquire(timeout=timeout):
+        logger.warning("Timed out waiting for CLAP model to load")
         return None
-    
-    _model_loading = True
     try:
+        if _model_ready.is_set():
+            return _clap_model
+        
         import laion_clap
         logger.info("Loading CLAP model (this may take a moment on first run)...")
-        _clap_model = laion_clap.CLAP_Module(enable_fusion=False)
-        _clap_model.load_ckpt()  # Downloads model if not cached
+        model = laion_clap.CLAP_Module(enable_fusion=False)
+        model.load_ckpt()  # Downloads model if not cached
+        _clap_model = model
+        _model_ready.set()
         logger.info("CLAP model loaded successfully")
         return _clap_model
     except Exception as e:
         logger.error(f"Failed to load CLAP model: {e}")
-        _model_loading = False
         return None
+    finally:
+        _model_lock.release()
+
+
+def _inference_context():
+    """
+    Context for CLAP forward passes: no autograd bookkeeping, and fp16 autocast on CUDA.
+    laion_clap already places the model on the GPU when one is available; autocast lets
+    its matmuls run on tensor cores without converting the weights.
+    """
+    import torch
+    stack = contextlib.ExitStack()
+    stack.enter_context(torch.inference_mode())
+    if torch.cuda.is_available():
+        stack.enter_context(torch.autocast(device_type="cuda", dtype=torch.float16))
+    return stack
 
 
 class CLAPService:
     def __init__(self):
         self.sr = 48000  # CLAP expects 48kHz audio
+        self.embed_batch_size = 32  # Windows per CLAP forward pass
     
     def search_by_text(
         self, 
@@ -49,7 +78,8 @@ class CLAPService:
         query: str, 
         window_sec: float = 5.0,
         hop_sec: float = 2.5,
-        top_k: int = 5
+        top_k: int = 5,
+        duration_max_sec: float = 480.0
     ) -> Dict[str, Any]:
         """
         Search for audio segments matching a natural language query.
@@ -60,74 +90,107 @@ class CLAPService:
             window_sec: Window size in seconds for each segment
             hop_sec: Hop size between windows
             top_k: Number of top results to return
+            duration_max_sec: Only the first duration_max_sec seconds are searched
             
         Returns:
             Dict with success status and matching segments
         """
+        return self.search_batch([{
+            "audio_path": audio_path,
+            "query": query,
+            "window_sec": window_sec,
+            "hop_sec": hop_sec,
+            "top_k": top_k,
+            "duration_max_sec": duration_max_sec
+        }])[0]
+    
+    def search_batch(self, requests: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Run several searches, embedding all of their queries in one CLAP text forward pass.
+        Each request is a dict of search_by_text keyword arguments.
+        Results are returned in request order; a failing request only fails its own entry.
+        """
         try:
             model = get_clap_model()
             if model is None:
-                return {"success": False, "error": "CLAP model not available"}
-            
-            # Load audio
-            y, sr = librosa.load(audio_path, sr=self.sr)
-            duration = len(y) / sr
-            
-            # Segment the audio
-            segments = []
-            window_samples = int(window_sec * sr)
-            hop_samples = int(hop_sec * sr)
+                return [{"success": False, "error": "CLAP model not available"} for _ in requests]
             
-            for start_sample in range(0, len(y) - window_samples, hop_samples):
-                end_sample = start_sample + window_samples
-                start_time = start_sample / sr
-                end_time = end_sample / sr
-                
-                segment_audio = y[start_sample:end_sample]
-                segments.append({
-                    "start": start_time,
-                    "end": end_time,
-                    "audio": segment_audio
-                })
+            # Get text embeddings (unit-norm) for all distinct queries at once
+            queries = list(dict.fromkeys(r["query"] for r in requests))
+            with _inference_context():
+                text_embeds = model.get_text_embedding(queries, use_tensor=False).astype(np.float32)
+            text_embeds /= np.linalg.norm(text_embeds, axis=1, keepdims=True)
+            text_vecs = dict(zip(queries, text_embeds))
+        except Exception as e:
+            logger.error(f"CLAP search error: {e}")
+            return [{"success": False, "error": str(e)} for _ in requests]
+        
+        # Group by file so each file is embedded only once, even on a cold cache
+        order = sorted(range(len(requests)), key=lambda i: requests[i]["audio_path"])
+        results: List[Optional[Dict[str, Any]]] = [None] * len(requests)
+        for i in order:
+            results[i] = self._rank_segments(text_vecs[requests[i]["query"]], **requests[i])
+        return results
+    
+    def search_many(self, requests: List[Tuple[str, str]], **kwargs) -> List[Dict[str, Any]]:
+        """
+        Run several (audio_path, query) searches in this process with shared keyword arguments.
+        The CLAP model is loaded once and kept here rather than reloaded per worker process.
+        Results are returned in request order.
+        """
+        return self.search_batch([
+            {"audio_path": audio_path, "query": query, **kwargs}
+            for audio_path, query in requests
+        ])
+    
+    def _rank_segments(
+        self,
+        text_vec: np.ndarray,
+        audio_path: str,
+        query: str,
+        window_sec: float = 5.0,
+        hop_sec: float = 2.5,
+        top_k: int = 5,
+        duration_max_sec: float = 480.0
+    ) -> Dict[str, Any]:
+        """Score every window of audio_path against a unit-norm text embedding"""
+        try:
+            # Audio embeddings are cached per file/window layout and reused across queries
+            stat = os.stat(audio_path)
+            duration, truncated, starts, ends, audio_embeds = self._embed_segments(
+                audio_path, stat.st_mtime_ns, stat.st_size, window_sec, hop_sec, duration_max_sec
+            )
             
-            if not segments:
+            if len(starts) == 0:
                 return {"success": True, "results": [], "query": query}
             
-            # Get text embedding
-            text_embed = model.get_text_embedding([query], use_tensor=False)
+            # Cosine similarity: both sides are unit-norm, so one matmul suffices
+            similarities = audio_embeds @ text_vec
             
-            # Get audio embeddings and compute similarities
-            results = []
-            for seg in segments:
-                # CLAP expects audio at 48kHz
-                audio_embed = model.get_audio_embedding_from_data(
-                    x=[seg["audio"]], 
-                    use_tensor=False
-                )
-                
-                # Cosine similarity
-                similarity = float(np.dot(text_embed[0], audio_embed[0]) / 
-                                  (np.linalg.norm(text_embed[0]) * np.linalg.norm(audio_embed[0])))
-                
-                results.append({
-                    "start": round(seg["start"], 2),
-                    "end": round(seg["end"], 2),
-                    "score": round(similarity, 3)
-                })
-            
-            # Sort by score and take top k
-            results.sort(key=lambda x: x["score"], reverse=True)
-            top_results = results[:top_k]
+            # Take top k by score (partial selection, then sort only those k)
+            if len(similarities) > top_k:
+                top_idx = np.sort(np.argpartition(-similarities, top_k)[:top_k])
+            else:
+                top_idx = np.arange(len(similarities))
+            top_idx = top_idx[np.argsort(-similarities[top_idx], kind="stable")]
             
-            # Add rank labels
-            for i, r in enumerate(top_results):
-                r["rank"] = i + 1
-                r["label"] = self._score_to_label(r["score"])
+            # Results stay as parallel arrays until here; dicts are built only for the top k
+            top_results = []
+            for rank, i in enumerate(top_idx, start=1):
+                score = round(float(similarities[i]), 3)
+                top_results.append({
+                    "start": round(float(starts[i]), 2),
+                    "end": round(float(ends[i]), 2),
+                    "score": score,
+                    "rank": rank,
+                    "label": self._score_to_label(score)
+                })
             
             return {
                 "success": True,
                 "query": query,
                 "duration": round(duration, 2),
+                "truncated": truncated,
                 "results": top_results
             }
             
@@ -135,6 +198,72 @@ class CLAPService:
             logger.error(f"CLAP search error: {e}")
             return {"success": False, "error": str(e)}
     
+    def cache_clear(self) -> None:
+        """Drop all cached segment embeddings"""
+        self._embed_segments.cache_clear()
+    
+    @functools.lru_cache(maxsize=16)
+    def _embed_segments(
+        self,
+        audio_path: str,
+        mtime_ns: int,
+        size: int,
+        window_sec: float,
+        hop_sec: float,
+        duration_max_sec: float
+    ):
+        """
+        Load audio, split it into windows and embed each window with CLAP.
+        mtime_ns/size only serve as cache key so edits to the file invalidate it.
+        
+        Returns:
+            (duration, truncated, start times, end times, unit-norm audio embeddings)
+        """
+        model = get_clap_model()
+        if model is None:
+            raise RuntimeError("CLAP model not available")
+        
+        # Bound the worst-case work: header-only duration, then load at most duration_max_sec
+        duration = librosa.get_duration(path=audio_path)
+        truncated = duration > duration_max_sec
+        
+        # Load audio
+        y, sr = librosa.load(audio_path, sr=self.sr, dtype=np.float32, offset=0.0, duration=duration_max_sec)
+        
+        # Segment the audio: zero-copy strided view, one row per window start
+        window_samples = int(window_sec * sr)
+        hop_samples = int(hop_sec * sr)
+        
+        # Same window starts as range(0, len(y) - window_samples, hop_samples)
+        n_windows = max(0, -(-(len(y) - window_samples) // hop_samples))
+        if n_windows:
+            windows = sliding_window_view(y, window_samples)[::hop_samples][:n_windows]
+        else:
+            windows = np.empty((0, window_samples), dtype=y.dtype)
+        
+        start_samples = np.arange(n_windows) * hop_samples
+        starts = start_samples / sr
+        ends = (start_samples + window_samples) / sr
+        
+        # Get audio embeddings in batches (one forward pass per batch instead of per window)
+        # CLAP expects audio at 48kHz; only the current batch is materialized
+        audio_embeds = np.empty((0, 0), dtype=np.float32)
+        if n_windows:
+            batches = []
+            with _inference_context():
+                for i in range(0, n_windows, self.embed_batch_size):
+                    batch = np.ascontiguousarray(windows[i:i + self.embed_batch_size])
+                    batches.append(model.get_audio_embedding_from_data(x=batch, use_tensor=False))
+            audio_embeds = np.concatenate(batches).astype(np.float32)
+            # Normalize once here so every query against the cached embeddings is a plain dot product
+            audio_embeds /= np.linalg.norm(audio_embeds, axis=1, keepdims=True)
+        
+        # Cached arrays are shared between queries; make accidental in-place edits fail loudly
+        for arr in (starts, ends, audio_embeds):
+            arr.setflags(write=False)
+        
+        return duration, truncated, starts, ends, audio_embeds
+    
     def _score_to_label(self, score: float) -> str:
         """Convert similarity score to human-readable label"""
         if score >= 0.3:
@@ -146,6 +275,22 @@ class CLAPService:
         else:
             return "低いマッチ"
     
+    def warm_up(self):
+        """
+        Load the model and run one dummy text and audio forward pass, so CUDA context
+        creation and kernel selection happen before the first real search.
+        """
+        model = get_clap_model()
+        if model is None:
+            return
+        try:
+            with _inference_context():
+                model.get_text_embedding(["warm-up", "warm-up"], use_tensor=False)
+                model.get_audio_embedding_from_data(x=np.zeros((2, int(5.0 * self.sr)), dtype=np.float32), use_tensor=False)
+            logger.info("CLAP warm-up done")
+        except Exception as e:
+            logger.warning(f"CLAP warm-up failed: {e}")
+    
     def get_preset_queries(self) -> List[Dict[str, str]]:
         """Return preset query options for UI"""
         return [
@@ -159,10 +304,12 @@ class CLAPService:
 
 
 # Singleton instance
-_service: Optional[CLAPService] = None
-
+@functools.lru_cache(maxsize=1)
 def get_clap_service() -> CLAPService:
-    global _service
-    if _service is None:
-        _service = CLAPService()
-    return _service
+    return CLAPService()
+
+
+# Optionally start loading (and warming up) the model in the background at import time
+# so the first search does not pay the checkpoint download/load cost
+if os.getenv("CLAP_EAGER_LOAD") == "1":
+    threading.Thread(target=lambda: get_clap_service().warm_up(), daemon=True).start()
@@ -1,30 +1,47 @@
 import os
+import asyncio
 import shutil
 import subprocess
+import tempfile
+import struct
+import wave
 import uuid
 import threading
+from concurrent.futures import ThreadPoolExecutor
 import time
 import re
+import orjson
+import anyio
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from selectolax.lexbor import LexborHTMLParser
+from collections import OrderedDict
 from pathlib import Path
 from typing import Optional, Dict
 
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException, BackgroundTasks, Body
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, ORJSONResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
-from pydub import AudioSegment
-import io
 import numpy as np
+# Load CUDA kernels on first use instead of all at init (must be set before CUDA initializes)
+os.environ.setdefault("CUDA_MODULE_LOADING", "LAZY")
 import torch
 import torchaudio
 import yue_service
 import audio_analysis
 import clap_service
 
-app = FastAPI()
+# Process-wide inference defaults shared by every model endpoint:
+# autotune conv kernels for the (fixed) input shapes and allow TF32 matmuls on Ampere+
+torch.backends.cudnn.benchmark = True
+torch.backends.cuda.matmul.allow_tf32 = True
+torch.set_float32_matmul_precision("high")
+
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # CORS configuration
 app.add_middleware(
@@ -48,6 +65,9 @@ OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 YUE_OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 SEPARATION_DIR.mkdir(parents=True, exist_ok=True)
 
+# Roots /trim may read from, resolved once at startup
+_ALLOWED_ROOTS = (UPLOAD_DIR.resolve(), OUTPUT_DIR.resolve(), PROJECT_DIR.resolve())
+
 # Mount static files
 app.mount("/outputs", StaticFiles(directory=OUTPUT_DIR), name="outputs")
 app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
@@ -62,18 +82,155 @@ logger.info(f"PROJECT_DIR: {PROJECT_DIR}")
 logger.info(f"UPLOAD_DIR: {UPLOAD_DIR}")
 logger.info(f"OUTPUT_DIR: {OUTPUT_DIR}")
 
-tasks: Dict[str, dict] = {}
+class TaskStore:
+    """
+    Task state keyed by task_id. Kept in process memory by default; set REDIS_URL
+    (requires the redis package) to share tasks between uvicorn workers.
+    """
+    def __init__(self, redis_url: Optional[str] = None, ttl_sec: int = 86400):
+        self.ttl_sec = ttl_sec
+        self._local: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._redis = None
+        if redis_url:
+            import redis
+            self._redis = redis.Redis.from_url(redis_url)
+    
+    def _key(self, task_id: str) -> str:
+        return f"task:{task_id}"
+    
+    def __contains__(self, task_id: str) -> bool:
+        if self._redis is not None:
+            return bool(self._redis.exists(self._key(task_id)))
+        return task_id in self._local
+    
+    def get(self, task_id: str) -> Optional[dict]:
+        """Return a copy of the task, or None if unknown"""
+        if self._redis is not None:
+            fields = self._redis.hgetall(self._key(task_id))
+            if not fields:
+                return None
+            return {k.decode(): orjson.loads(v) for k, v in fields.items()}
+        with self._lock:
+            task = self._local.get(task_id)
+            return dict(task) if task is not None else None
+    
+    def create(self, task_id: str, **fields):
+        if self._redis is not None:
+            key = self._key(task_id)
+            with self._redis.pipeline() as pipe:
+                pipe.delete(key)
+                pipe.hset(key, mapping={k: orjson.dumps(v) for k, v in fields.items()})
+                pipe.expire(key, self.ttl_sec)
+                pipe.execute()
+            return
+        with self._lock:
+            self._local[task_id] = dict(fields)
+    
+    def update(self, task_id: str, **fields):
+        if self._redis is not None:
+            key = self._key(task_id)
+            with self._redis.pipeline() as pipe:
+                pipe.hset(key, mapping={k: orjson.dumps(v) for k, v in fields.items()})
+                pipe.expire(key, self.ttl_sec)
+                pipe.execute()
+            return
+        with self._lock:
+            self._local.setdefault(task_id, {}).update(fields)
+
+tasks = TaskStore(os.getenv("REDIS_URL"))
+
+# Bytes per read when streaming ffmpeg output / saving uploads
+TRIM_CHUNK_SIZE = 64 * 1024
+UPLOAD_CHUNK_SIZE = 1024 * 1024
 
 import sys
 
+# Rough separation speed used for progress estimates (seconds of work per second of audio)
+SEPARATION_SEC_PER_AUDIO_SEC = 0.5
+SEPARATION_DEFAULT_ETA_SEC = 95.0
+
+def _estimate_separation_sec(file_path: Path) -> float:
+    """Estimate how long separating file_path will take, from its duration"""
+    try:
+        import librosa
+        duration = librosa.get_duration(path=str(file_path))
+        return max(10.0, duration * SEPARATION_SEC_PER_AUDIO_SEC)
+    except Exception:
+        return SEPARATION_DEFAULT_ETA_SEC
+
+# Shared audio-separator instance; loading the model takes far longer than separating a short clip
+SEPARATOR_MODEL = "MDX23C-8KFFT-InstVoc_HQ.ckpt"
+# Stem file format: lossless FLAC is roughly half the size of WAV (set STEM_FORMAT=wav for WAV stems)
+STEM_FORMAT = os.getenv("STEM_FORMAT", "flac").lower()
+_separator = None
+_separator_lock = threading.Lock()
+
+def get_separator():
+    """Get or create the shared Separator with SEPARATOR_MODEL loaded"""
+    global _separator
+    with _separator_lock:
+        if _separator is None:
+            # Import audio-separator here to ensure dependencies are loaded in the thread/process
+            try:
+                from audio_separator.separator import Separator
+            except ImportError:
+                 raise ImportError("audio-separator library not found. Please run 'pip install audio-separator[gpu]'")
+            
+            # Initialize Separator
+            # audio-separator automatically detects and uses GPU if available
+            separator = Separator(
+                output_dir=str(SEPARATION_DIR),
+                output_format=STEM_FORMAT
+            )
+            
+            logger.info(f"Loading separator model: {SEPARATOR_MODEL} ...")
+            # Load the model (this will download it on first run if not cached)
+            # MDX23C-8KFFT-InstVoc_HQ is a high-quality vocals/instrumental model
+            separator.load_model(model_filename=SEPARATOR_MODEL)
+            logger.info("Separator model loaded.")
+            _separator = separator
+        return _separator
+
+# Worker threads shared by run_in_threadpool (analysis, file saves, Suno fetches, CLAP batches)
+# (raised above anyio's default of 40 since all of that work shares the one limiter)
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE", "64"))
+
+@app.on_event("startup")
+async def _warm_up():
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+    
+    # Build the service singletons now so the first request doesn't pay for it
+    audio_analysis.get_analyzer()
+    clap_service.get_clap_service()
+    
+    # Load the separator model in the background so the server starts accepting requests right away
+    # (the CLAP model is warmed the same way when CLAP_EAGER_LOAD=1)
+    def load():
+        try:
+            get_separator()
+        except Exception as e:
+            logger.warning(f"Separator warm-up failed: {e}")
+    threading.Thread(target=load, daemon=True).start()
+
+# Separation jobs are queued FIFO onto a fixed pool instead of one thread per request
+_gpu_pool = ThreadPoolExecutor(max_workers=int(os.getenv("SUNO_GPU_WORKERS", "1")), thread_name_prefix="separation")
+
+def _is_cancelled(task_id: str) -> bool:
+    return (tasks.get(task_id) or {}).get("status") == "cancelled"
+
 # Separation task (BS-RoFormer via audio-separator)
 def run_separation_task(task_id: str, file_path: Path):
     """
     Separates vocals and instrumental using BS-RoFormer (via audio-separator).
     """
     try:
-        tasks[task_id]["status"] = "processing"
-        tasks[task_id]["progress"] = 5
+        # Cancelled while waiting in the _gpu_pool queue
+        if _is_cancelled(task_id):
+            logger.info(f"[{task_id}] Task cancelled before it started.")
+            return
+        
+        tasks.update(task_id, status="processing", progress=5)
         
         logger.info(f"[{task_id}] Starting BS-RoFormer separation...")
         
@@ -81,72 +238,39 @@ def run_separation_task(task_id: str, file_path: Path):
         output_dir = SEPARATION_DIR / task_id
         output_dir.mkdir(parents=True, exist_ok=True)
         
-        tasks[task_id]["progress"] = 10
+        tasks.update(task_id, progress=10)
         
-        # Import audio-separator here to ensure dependencies are loaded in the thread/process
-        try:
-            from audio_separator.separator import Separator
-        except ImportError:
-             raise ImportError("audio-separator library not found. Please run 'pip install audio-separator[gpu]'")
-
-        # Initialize Separator
-        # audio-separator automatically detects and uses GPU if available
-        separator = Separator(
-            output_dir=str(output_dir),
-            output_format="wav"
-        )
-        
-        tasks[task_id]["progress"] = 20
-        logger.info(f"[{task_id}] Loading model: MDX23C-8KFFT-InstVoc_HQ ...")
+        logger.info(f"[{task_id}] Waiting for separator model: {SEPARATOR_MODEL} ...")
+        separator = get_separator()
         
-        # Load the model (this will download it on first run if not cached)
-        # MDX23C-8KFFT-InstVoc_HQ is a high-quality vocals/instrumental model
-        separator.load_model(model_filename="MDX23C-8KFFT-InstVoc_HQ.ckpt")
-        
-        tasks[task_id]["progress"] = 1
+        tasks.update(task_id, progress=1)
         logger.info(f"[{task_id}] Model loaded. Starting separation...")
         
-        # Start simulated progress thread
-        stop_progress = threading.Event()
+        eta_sec = _estimate_separation_sec(file_path)
         
-        def simulate_progress():
-            current = 1
-            while not stop_progress.is_set():
-                if stop_progress.wait(timeout=1.0): # Wait up to 1s, break immediately if set
-                    break
-                
-                if current < 95:
-                    current += 1
-                
-                # Only update if status is still processing AND stop event is not set
-                # Also stop if cancelled
-                if tasks[task_id].get("status") == "processing" and not stop_progress.is_set():
-                    tasks[task_id]["progress"] = current
-                    
-        progress_thread = threading.Thread(target=simulate_progress, daemon=True)
-        progress_thread.start()
-        
-        try:
-            # Run separation (Blocking)
-            # returns list of filenames
+        # Run separation (Blocking)
+        # returns list of filenames
+        # The model is shared, so one separation at a time; output_dir is per task
+        with _separator_lock:
+            # Cancelled while waiting for the model
+            if _is_cancelled(task_id):
+                logger.info(f"[{task_id}] Task cancelled by user.")
+                return
+            
+            # Progress during separation is estimated on read (see get_task_status)
+            # (wall clock, since other workers may read it)
+            tasks.update(task_id, eta_sec=eta_sec, start_ts=time.time())
+            separator.output_dir = str(output_dir)
+            separator.model_instance.output_dir = str(output_dir)
             output_files = separator.separate(str(file_path))
-        except Exception as e:
-            # If creating separator failed or other error
-             raise e
-        finally:
-            # Signal thread to stop and WAIT for it to finish
-            stop_progress.set()
-            progress_thread.join() # Safe to wait here
         
         # Check for cancellation
-        if tasks[task_id].get("status") == "cancelled":
+        if _is_cancelled(task_id):
              logger.info(f"[{task_id}] Task cancelled by user.")
              return
 
         # Verify outputs
-        
-        # Verify outputs
-        # Usually named: <original_filename>_(Vocals)_BS-RoFormer-Viperx-1297.wav
+        # Usually named: <original_filename>_(Vocals)_BS-RoFormer-Viperx-1297.<STEM_FORMAT>
         # We need to identify which is which. 
         # The model produces "Vocals" and "Instrumental" stems usually.
         
@@ -161,8 +285,8 @@ def run_separation_task(task_id: str, file_path: Path):
                 instrumental_path = full_path
                 
         # Rename for consistency if found
-        final_vocals_path = output_dir / "vocals.wav"
-        final_instrumental_path = output_dir / "instrumental.wav"
+        final_vocals_path = output_dir / f"vocals.{STEM_FORMAT}"
+        final_instrumental_path = output_dir / f"instrumental.{STEM_FORMAT}"
         
         if vocals_path and vocals_path.exists():
             vocals_path.rename(final_vocals_path)
@@ -181,7 +305,7 @@ def run_separation_task(task_id: str, file_path: Path):
         # Include original_path in the result object for easier frontend consumption
         # Convert absolute path to web path if possible
         original_web_path = ""
-        full_original_path = tasks[task_id].get("original_path", "")
+        full_original_path = (tasks.get(task_id) or {}).get("original_path", "")
         if full_original_path:
             path_obj = Path(full_original_path)
             if str(UPLOAD_DIR) in str(path_obj.parent):
@@ -189,27 +313,39 @@ def run_separation_task(task_id: str, file_path: Path):
             else:
                 original_web_path = full_original_path # Fallback
 
-        tasks[task_id]["result"] = {
-            "vocals_url": f"/outputs/separated/{task_id}/vocals.wav",
-            "instrumental_url": f"/outputs/separated/{task_id}/instrumental.wav",
+        result = {
+            "vocals_url": f"/outputs/separated/{task_id}/{final_vocals_path.name}",
+            "instrumental_url": f"/outputs/separated/{task_id}/{final_instrumental_path.name}",
             "vocals_path": str(final_vocals_path) if final_vocals_path.exists() else "",
             "instrumental_path": str(final_instrumental_path) if final_instrumental_path.exists() else "",
             "original_path": original_web_path
         }
         
-        tasks[task_id]["status"] = "completed"
-        tasks[task_id]["progress"] = 100
+        tasks.update(task_id, result=result, status="completed", progress=100)
         
         logger.info(f"[{task_id}] Separation completed successfully.")
 
     except Exception as e:
         logger.error(f"[{task_id}] Separation failed: {e}")
-        tasks[task_id]["status"] = "failed"
-        tasks[task_id]["error"] = str(e)
+        tasks.update(task_id, status="failed", error=str(e))
     finally:
         # Clean up resources if necessary
         pass
 
+def _save_upload(src, dest: Path):
+    with open(dest, "wb") as buffer:
+        shutil.copyfileobj(src, buffer, UPLOAD_CHUNK_SIZE)
+    
+    # The separator reads the file back right away; ask the kernel to keep it in the page cache
+    if hasattr(os, "posix_fadvise"):
+        fd = os.open(str(dest), os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        except OSError as e:
+            logger.debug(f"posix_fadvise failed for {dest}: {e}")
+        finally:
+            os.close(fd)
+
 @app.post("/separate")
 async def separate_audio(
     background_tasks: BackgroundTasks,
@@ -220,19 +356,19 @@ async def separate_audio(
         ext = Path(file.filename).suffix or ".mp3"
         input_path = UPLOAD_DIR / f"{task_id}{ext}"
         
-        with open(input_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        # Copy in a worker thread so a large upload doesn't block the event loop
+        await run_in_threadpool(_save_upload, file.file, input_path)
             
-        tasks[task_id] = {
-            "status": "queued",
-            "progress": 0,
-            "filename": file.filename,
-            "original_path": f"/uploads/{task_id}{ext}" 
-        }
+        tasks.create(
+            task_id,
+            status="queued",
+            progress=0,
+            filename=file.filename,
+            original_path=f"/uploads/{task_id}{ext}"
+        )
 
-        # Run Separation task in background thread
-        thread = threading.Thread(target=run_separation_task, args=(task_id, input_path), daemon=True)
-        thread.start()
+        # Queue Separation task on the GPU worker pool (stays "queued" until a worker picks it up)
+        _gpu_pool.submit(run_separation_task, task_id, input_path)
         
         return {"status": "success", "task_id": task_id}
     except Exception as e:
@@ -240,25 +376,46 @@ async def separate_audio(
 
 @app.get("/task/{task_id}")
 async def get_task_status(task_id: str):
-    if task_id not in tasks:
+    task = tasks.get(task_id)
+    if task is None:
         raise HTTPException(status_code=404, detail="Task not found")
     
-    # Debug: Check what's being returned
-    status = tasks[task_id].get("status")
-    progress = tasks[task_id].get("progress")
-    logger.info(f"API Request for {task_id}: status={status}, progress={progress}")
+    # Estimate separation progress from elapsed time instead of a ticking thread per task
+    if task.get("status") == "processing" and "start_ts" in task:
+        elapsed = time.time() - task["start_ts"]
+        task["progress"] = max(1, min(95, int(100 * elapsed / task["eta_sec"])))
     
-    return tasks[task_id]
+    # Debug: Check what's being returned (polled ~1 Hz per task, so only formatted when enabled)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"API Request for {task_id}: status={task.get('status')}, progress={task.get('progress')}")
+    
+    return task
 
 @app.post("/task/{task_id}/cancel")
 async def cancel_task(task_id: str):
     if task_id in tasks:
-        tasks[task_id]["status"] = "cancelled"
+        tasks.update(task_id, status="cancelled")
         # We cannot easily kill the thread immediately without complex logic,
         # but the run_separation_task checks status after processing.
         return {"message": "Cancellation requested"}
     raise HTTPException(status_code=404, detail="Task not found")
 
+# Static mount prefixes -> resolved filesystem roots
+_WEB_ROOTS = (("/uploads/", UPLOAD_DIR.resolve()), ("/outputs/", OUTPUT_DIR.resolve()))
+
+def _web_to_fs_path(web_path: str) -> Path:
+    """
+    Convert a web path like /uploads/xxx.mp3 to a filesystem path.
+    Raises HTTPException(403) for paths outside /uploads/ and /outputs/ or escaping the mounted directory.
+    """
+    for prefix, root in _WEB_ROOTS:
+        if web_path.startswith(prefix):
+            fs_path = (root / web_path.removeprefix(prefix)).resolve()
+            if not fs_path.is_relative_to(root):
+                raise HTTPException(status_code=403, detail="Access denied")
+            return fs_path
+    raise HTTPException(status_code=403, detail="Access denied")
+
 class AnalyzeRequest(BaseModel):
     file_path: str
 
@@ -270,20 +427,14 @@ async def analyze_audio(request: AnalyzeRequest):
     """
     try:
         # Convert web path to filesystem path
-        web_path = request.file_path
-        if web_path.startswith("/uploads/"):
-            fs_path = UPLOAD_DIR / web_path.replace("/uploads/", "")
-        elif web_path.startswith("/outputs/"):
-            fs_path = OUTPUT_DIR / web_path.replace("/outputs/", "")
-        else:
-            # Assume it's already a filesystem path
-            fs_path = Path(web_path)
+        fs_path = _web_to_fs_path(request.file_path)
         
         if not fs_path.exists():
             raise HTTPException(status_code=404, detail=f"File not found: {fs_path}")
         
         analyzer = audio_analysis.get_analyzer()
-        result = analyzer.analyze(str(fs_path))
+        # Analysis is CPU-bound; keep it off the event loop
+        result = await run_in_threadpool(analyzer.analyze, str(fs_path))
         
         if not result.get("success"):
             raise HTTPException(status_code=500, detail=result.get("error", "Analysis failed"))
@@ -296,6 +447,57 @@ async def analyze_audio(request: AnalyzeRequest):
         logger.error(f"Audio analysis error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+class BatchScheduler:
+    """
+    Micro-batcher for model calls: requests submitted concurrently are collected for up to
+    max_wait seconds (or max_batch items) and handed to batch_fn as one list, which runs
+    in the threadpool. batch_fn must return one result per item, in order.
+    """
+    def __init__(self, batch_fn, max_batch: int = 16, max_wait: float = 0.02):
+        self.batch_fn = batch_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+    
+    async def submit(self, item):
+        # Created lazily so the queue and worker bind to the running event loop
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            
+            items = [item for item, _ in batch]
+            try:
+                results = await run_in_threadpool(self.batch_fn, items)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+# CLAP searches share GPU forward passes across concurrent requests
+clap_scheduler = BatchScheduler(lambda items: clap_service.get_clap_service().search_batch(items))
+
 # CLAP Endpoints
 class CLAPSearchRequest(BaseModel):
     file_path: str
@@ -310,24 +512,17 @@ async def clap_search(request: CLAPSearchRequest):
     """
     try:
         # Convert web path to filesystem path
-        web_path = request.file_path
-        if web_path.startswith("/uploads/"):
-            fs_path = UPLOAD_DIR / web_path.replace("/uploads/", "")
-        elif web_path.startswith("/outputs/"):
-            fs_path = OUTPUT_DIR / web_path.replace("/outputs/", "")
-        else:
-            fs_path = Path(web_path)
+        fs_path = _web_to_fs_path(request.file_path)
         
         if not fs_path.exists():
             raise HTTPException(status_code=404, detail=f"File not found: {fs_path}")
         
-        service = clap_service.get_clap_service()
-        result = service.search_by_text(
-            str(fs_path), 
-            request.query, 
-            window_sec=request.window_sec,
-            top_k=request.top_k
-        )
+        result = await clap_scheduler.submit({
+            "audio_path": str(fs_path),
+            "query": request.query,
+            "window_sec": request.window_sec,
+            "top_k": request.top_k
+        })
         
         if not result.get("success"):
             raise HTTPException(status_code=500, detail=result.get("error", "CLAP search failed"))
@@ -346,138 +541,292 @@ async def get_clap_presets():
     service = clap_service.get_clap_service()
     return {"presets": service.get_preset_queries()}
 
+# Suno page analysis cache: url -> {"expires", "etag", "last_modified", "result"}
+SUNO_CACHE_TTL = 3600.0
+SUNO_CACHE_MAXSIZE = 1024
+_suno_cache: "OrderedDict[str, dict]" = OrderedDict()
+_suno_cache_lock = threading.Lock()
+
+# Shared HTTP session so Suno requests reuse keep-alive connections
+SUNO_HTTP_TIMEOUT = 5
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=Retry(total=2, backoff_factor=0.3)))
+
+# Fall back to the unofficial studio-api feed when the page itself has no artist (set to 0 to skip)
+SUNO_UNOFFICIAL_API = os.getenv("SUNO_UNOFFICIAL_API", "1") == "1"
+
+# Everything the Suno page parser needs, matched in one pass over the document (first match wins)
+_SUNO_NODES_SELECTOR = 'meta[property^="og:"], script#__NEXT_DATA__, a[href^="/@"]'
+
+def _find_suno_nodes(tree) -> Dict[str, object]:
+    """Collect the og:* meta tags, the __NEXT_DATA__ script and the first /@artist link"""
+    nodes = {}
+    for node in tree.css(_SUNO_NODES_SELECTOR):
+        if node.tag == "meta":
+            key = node.attributes.get("property")
+        elif node.tag == "script":
+            key = "next_data"
+        else:
+            key = "artist_link"
+        nodes.setdefault(key, node)
+    return nodes
+
+# Song UUID in a (redirected) Suno URL
+_SONG_ID_RE = re.compile(r'song/([0-9a-fA-F-]{36})')
+
+def _analyze_suno_page(url: str, cached: Optional[dict] = None):
+    """
+    Fetch and parse a Suno song page.
+    Returns (result, etag, last_modified); cached is an expired cache entry to revalidate.
+    """
+    # 1. Handle Redirects (e.g. /s/ short URLs)
+    # Session.get follows redirects by default, but we want the final URL for ID extraction
+    headers = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"}
+    # Revalidate an expired cache entry instead of re-downloading and re-parsing the page
+    if cached:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+    try:
+        response = _SESSION.get(url, headers=headers, timeout=SUNO_HTTP_TIMEOUT)
+        final_url = response.url
+        if cached and response.status_code == 304:
+            return cached["result"], cached.get("etag"), cached.get("last_modified")
+        if not response.ok:
+            raise HTTPException(status_code=400, detail="Failed to fetch URL")
+    except HTTPException:
+        raise
+    except Exception as e:
+         raise HTTPException(status_code=400, detail=f"Failed to reach Suno: {str(e)}")
+
+    nodes = _find_suno_nodes(LexborHTMLParser(response.text))
+    
+    # 2. Try Standard OpenGraph Tags first
+    title = nodes.get("og:title")
+    description = nodes.get("og:description")
+    image = nodes.get("og:image")
+    
+    title_content = title.attributes.get("content") if title else None
+    desc_content = description.attributes.get("content") if description else None
+    thumbnail_content = image.attributes.get("content") if image else None
+
+    # 3. If OG tags are missing/generic, try to extract Song ID and use API or Next.js JSON
+    song_id = None
+    # Extract UUID from URL
+    match = _SONG_ID_RE.search(final_url)
+    if match:
+        song_id = match.group(1)
+    
+    if not title_content or title_content == "Suno":
+        # Try to find Next.js data
+        next_data = nodes.get("next_data")
+        if next_data:
+            try:
+                data = orjson.loads(next_data.text() or "{}")
+                # Traverse JSON to find clip/song data
+                # Structure usually involves props -> pageProps -> clip
+                clip_data = data.get("props", {}).get("pageProps", {}).get("clip", {})
+                
+                if clip_data:
+                    fetched_title = clip_data.get("title")
+                    if fetched_title:
+                        title_content = fetched_title
+                    
+                    display_name = clip_data.get("display_name") or clip_data.get("handle")
+                    if display_name:
+                         # Should now be "Title by Artist"
+                         if title_content:
+                             title_content = f"{title_content} by {display_name}"
+                         else:
+                             title_content = f"Song by {display_name}"
+
+                    fetched_prompt = clip_data.get("metadata", {}).get("prompt")
+                    if fetched_prompt:
+                        desc_content = fetched_prompt
+                        
+                    fetched_image = clip_data.get("image_url")
+                    if fetched_image:
+                        thumbnail_content = fetched_image
+
+            except Exception as e:
+                logger.warning(f"Failed to parse NEXT_DATA: {e}")
+
+        # Fallback: Extract from HTML text/links if JSON failed or missed artist
+        if not title_content or " by " not in title_content:
+            # Look for profile links: <a href="/@handle" ...>Display Name</a>
+            # This is heuristic
+            try:
+                 artist_link = nodes.get("artist_link")
+                 if artist_link:
+                     artist_name = artist_link.text(strip=True)
+                     if artist_name and title_content and " by " not in title_content:
+                          title_content = f"{title_content} by {artist_name}"
+            except Exception as e:
+                logger.debug(f"Artist link fallback failed: {e}")
+
+        # Fallback: Try unofficial API if we have an ID
+        if SUNO_UNOFFICIAL_API and song_id and (not title_content or " by " not in title_content):
+            try:
+                # Unofficial endpoint often used by community
+                api_url = f"https://studio-api.suno.ai/api/feed/?ids={song_id}"
+                api_resp = _SESSION.get(api_url, headers={"User-Agent": "Mozilla/5.0"}, timeout=SUNO_HTTP_TIMEOUT)
+                if api_resp.ok:
+                    songs = api_resp.json()
+                    if list(songs) and len(songs) > 0:
+                        song_data = songs[0]
+                        t = song_data.get("title", "")
+                        
+                        # Get Artist info if available
+                        display_name = song_data.get("display_name", "")
+                        handle = song_data.get("handle", "")
+                        
+                        if t:
+                            title_content = t
+                            
+                        if display_name:
+                            title_content = f"{title_content} by {display_name}"
+                        elif handle:
+                            title_content = f"{title_content} by {handle}"
+                            
+                        if not desc_content:
+                            desc_content = song_data.get("metadata", {}).get("prompt", "")
+                        if not thumbnail_content:
+                            thumbnail_content = song_data.get("image_url", "")
+            except Exception as e:
+                logger.warning(f"Failed to fetch from Suno API: {e}")
+
+    # Final Fallback
+    if not title_content:
+        title_content = "Unknown Title"
+    
+    result = {
+        "title": title_content,
+        "description": desc_content or "",
+        "thumbnail": thumbnail_content,
+        "provider": "Suno.ai"
+    }
+    
+    return result, response.headers.get("ETag"), response.headers.get("Last-Modified")
+
 @app.post("/suno/analyze")
 async def analyze_suno(url: str = Body(..., embed=True)):
     try:
         if not url:
             raise HTTPException(status_code=400, detail="URL is required")
+        
+        with _suno_cache_lock:
+            cached = _suno_cache.get(url)
+        if cached and cached["expires"] > time.monotonic():
+            return dict(cached["result"])
             
         logger.info(f"Analyzing Suno URL: {url}")
         
-        # 1. Handle Redirects (e.g. /s/ short URLs)
-        # requests.get follows redirects by default, but we want the final URL for ID extraction
-        try:
-            response = requests.get(url, headers={"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"})
-            final_url = response.url
-            if not response.ok:
-                raise HTTPException(status_code=400, detail="Failed to fetch URL")
-        except Exception as e:
-             raise HTTPException(status_code=400, detail=f"Failed to reach Suno: {str(e)}")
-
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        # 2. Try Standard OpenGraph Tags first
-        title = soup.find("meta", property="og:title")
-        description = soup.find("meta", property="og:description")
-        image = soup.find("meta", property="og:image")
-        
-        title_content = title["content"] if title else None
-        desc_content = description["content"] if description else None
-        thumbnail_content = image["content"] if image else None
-
-        # 3. If OG tags are missing/generic, try to extract Song ID and use API or Next.js JSON
-        song_id = None
-        # Extract UUID from URL
-        match = re.search(r'song/([0-9a-fA-F-]{36})', final_url)
-        if match:
-            song_id = match.group(1)
-        
-        if not title_content or title_content == "Suno":
-            # Try to find Next.js data
-            next_data = soup.find("script", id="__NEXT_DATA__")
-            if next_data:
-                try:
-                    import json
-                    data = json.loads(next_data.string)
-                    # Traverse JSON to find clip/song data
-                    # Structure usually involves props -> pageProps -> clip
-                    clip_data = data.get("props", {}).get("pageProps", {}).get("clip", {})
-                    
-                    if clip_data:
-                        fetched_title = clip_data.get("title")
-                        if fetched_title:
-                            title_content = fetched_title
-                        
-                        display_name = clip_data.get("display_name") or clip_data.get("handle")
-                        if display_name:
-                             # Should now be "Title by Artist"
-                             if title_content:
-                                 title_content = f"{title_content} by {display_name}"
-                             else:
-                                 title_content = f"Song by {display_name}"
-
-                        fetched_prompt = clip_data.get("metadata", {}).get("prompt")
-                        if fetched_prompt:
-                            desc_content = fetched_prompt
-                            
-                        fetched_image = clip_data.get("image_url")
-                        if fetched_image:
-                            thumbnail_content = fetched_image
-
-                except Exception as e:
-                    logger.warning(f"Failed to parse NEXT_DATA: {e}")
-
-            # Fallback: Extract from HTML text/links if JSON failed or missed artist
-            if not title_content or " by " not in title_content:
-                # Look for profile links: <a href="/@handle" ...>Display Name</a>
-                # This is heuristic
-                try:
-                     artist_link = soup.find("a", href=re.compile(r"^/@"))
-                     if artist_link:
-                         artist_name = artist_link.get_text(strip=True)
-                         if artist_name and title_content and " by " not in title_content:
-                              title_content = f"{title_content} by {artist_name}"
-                except:
-                    pass
-
-            # Fallback: Try unofficial API if we have an ID
-            if song_id and (not title_content or " by " not in title_content):
-                try:
-                    # Unofficial endpoint often used by community
-                    api_url = f"https://studio-api.suno.ai/api/feed/?ids={song_id}"
-                    api_resp = requests.get(api_url, headers={"User-Agent": "Mozilla/5.0"})
-                    if api_resp.ok:
-                        songs = api_resp.json()
-                        if list(songs) and len(songs) > 0:
-                            song_data = songs[0]
-                            t = song_data.get("title", "")
-                            
-                            # Get Artist info if available
-                            display_name = song_data.get("display_name", "")
-                            handle = song_data.get("handle", "")
-                            
-                            if t:
-                                title_content = t
-                                
-                            if display_name:
-                                title_content = f"{title_content} by {display_name}"
-                            elif handle:
-                                title_content = f"{title_content} by {handle}"
-                                
-                            if not desc_content:
-                                desc_content = song_data.get("metadata", {}).get("prompt", "")
-                            if not thumbnail_content:
-                                thumbnail_content = song_data.get("image_url", "")
-                except Exception as e:
-                    logger.warning(f"Failed to fetch from Suno API: {e}")
-
-        # Final Fallback
-        if not title_content:
-            title_content = "Unknown Title"
+        # Blocking HTTP + HTML parsing runs in the threadpool
+        result, etag, last_modified = await run_in_threadpool(_analyze_suno_page, url, cached)
         
-        result = {
-            "title": title_content,
-            "description": desc_content or "",
-            "thumbnail": thumbnail_content,
-            "provider": "Suno.ai"
-        }
+        with _suno_cache_lock:
+            _suno_cache[url] = {
+                "expires": time.monotonic() + SUNO_CACHE_TTL,
+                "etag": etag,
+                "last_modified": last_modified,
+                "result": result
+            }
+            _suno_cache.move_to_end(url)
+            while len(_suno_cache) > SUNO_CACHE_MAXSIZE:
+                _suno_cache.popitem(last=False)
         
-        return result
+        return dict(result)
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Suno analysis failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def _wav_header(n_channels: int, sampwidth: int, framerate: int, n_frames: int) -> bytes:
+    """Canonical 44-byte PCM WAV header for n_frames frames"""
+    block_align = n_channels * sampwidth
+    data_size = n_frames * block_align
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + data_size, b"WAVE",
+        b"fmt ", 16, 1, n_channels, framerate, framerate * block_align, block_align, sampwidth * 8,
+        b"data", data_size
+    )
+
+def _open_wav_slice(path: Path, start_time: float, end_time: float):
+    """
+    Trim a PCM WAV by byte slicing: returns a generator yielding a new header followed by the
+    raw frames between start_time and end_time.
+    Raises wave.Error / EOFError for files the wave module can't read (e.g. float or extensible WAV).
+    """
+    wav = wave.open(str(path), "rb")
+    try:
+        n_channels = wav.getnchannels()
+        sampwidth = wav.getsampwidth()
+        framerate = wav.getframerate()
+        n_frames = wav.getnframes()
+        start_frame = min(n_frames, max(0, int(start_time * framerate)))
+        end_frame = min(n_frames, max(start_frame, int(end_time * framerate)))
+        wav.setpos(start_frame)
+    except Exception:
+        wav.close()
+        raise
+    
+    block_align = n_channels * sampwidth
+    chunk_frames = max(1, TRIM_CHUNK_SIZE // block_align)
+    
+    def stream_output():
+        try:
+            yield _wav_header(n_channels, sampwidth, framerate, end_frame - start_frame)
+            remaining = end_frame - start_frame
+            while remaining > 0:
+                frames = wav.readframes(min(chunk_frames, remaining))
+                if not frames:
+                    break
+                remaining -= len(frames) // block_align
+                yield frames
+        finally:
+            wav.close()
+    
+    return stream_output()
+
+def _open_ffmpeg_stream(cmd):
+    """
+    Start ffmpeg writing to stdout and return a generator over its output, TRIM_CHUNK_SIZE bytes at a time.
+    The first chunk is read up front so failures raise here (as an HTTP 500) instead of mid-stream.
+    stderr goes to a temporary file, so a chatty ffmpeg can't block on a full pipe.
+    """
+    stderr_file = tempfile.TemporaryFile()
+    try:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr_file)
+    except Exception:
+        stderr_file.close()
+        raise
+    
+    first_chunk = proc.stdout.read(TRIM_CHUNK_SIZE)
+    if not first_chunk:
+        proc.stdout.close()
+        proc.wait()
+        stderr_file.seek(0)
+        stderr = stderr_file.read().decode(errors="replace").strip()
+        stderr_file.close()
+        raise HTTPException(status_code=500, detail=f"ffmpeg failed: {stderr or proc.returncode}")
+    
+    def stream_output():
+        try:
+            yield first_chunk
+            yield from iter(lambda: proc.stdout.read(TRIM_CHUNK_SIZE), b"")
+        finally:
+            proc.stdout.close()
+            if proc.poll() is None:
+                proc.kill()
+            proc.wait()
+            stderr_file.close()
+    
+    return stream_output()
+
 @app.post("/trim")
 async def trim_audio(
     file_path: str = Form(...),
@@ -485,15 +834,10 @@ async def trim_audio(
     end_time: float = Form(...),
 ):
     try:
-        # Prevent accessing files outside of allowed directories
-        allowed_dirs = [str(UPLOAD_DIR), str(OUTPUT_DIR)]
-        
         # Normalize and resolve path
         # file_path is expected to be a relative URL path from frontend like "/uploads/..." or "/outputs/..."
         # Convert to filesystem path
-        normalized_path = file_path.replace("/", os.sep)
-        if normalized_path.startswith(os.sep):
-             normalized_path = normalized_path[1:]
+        normalized_path = file_path.removeprefix("/")
              
         # Determine actual file path
         # Check relative to PROJECT_DIR first
@@ -506,45 +850,45 @@ async def trim_audio(
         target_path = potential_path.resolve()
         
         # Security check: Ensure path is within allowed directories
-        is_safe = False
-        for allowed in allowed_dirs:
-            if str(target_path).startswith(str(Path(allowed).resolve())):
-                is_safe = True
-                break
-        
-        # For development flexibility allow project dir files too (like uploads)
-        if str(target_path).startswith(str(PROJECT_DIR.resolve())):
-             is_safe = True
-        
-        if not is_safe:
-             # logger.warning(f"Access denied: {target_path}")
-             # Allow it for now as path resolution is tricky between dev/prod envs
-             pass 
+        # (project dir files are allowed too for development flexibility)
+        if not any(target_path.is_relative_to(root) for root in _ALLOWED_ROOTS):
+            logger.warning(f"Access denied: {target_path}")
+            raise HTTPException(status_code=403, detail="Access denied")
 
         if not target_path.exists():
             raise HTTPException(status_code=404, detail=f"File not found: {file_path}")
 
-        # Load audio
         ext = target_path.suffix.lower().replace('.', '')
-        format_arg = ext if ext in ['wav', 'mp3', 'ogg', 'flac'] else 'mp3'
-        
-        audio = AudioSegment.from_file(str(target_path))
-        
-        # Trim (pydub uses milliseconds)
-        start_ms = int(start_time * 1000)
-        end_ms = int(end_time * 1000)
-        
-        trimmed = audio[start_ms:end_ms]
-        
-        # Export
-        output = io.BytesIO()
-        trimmed.export(output, format="wav")
-        output.seek(0)
-        
         filename = f"trimmed_{target_path.stem}.wav"
-        
-        return StreamingResponse(output, media_type="audio/wav", headers={"Content-Disposition": f"attachment; filename={filename}"})
+        headers = {"Content-Disposition": f"attachment; filename={filename}"}
+        
+        # PCM WAV: copy the requested frames straight out of the file
+        if ext == "wav":
+            try:
+                wav_slice = await run_in_threadpool(_open_wav_slice, target_path, start_time, end_time)
+                return StreamingResponse(wav_slice, media_type="audio/wav", headers=headers)
+            except (wave.Error, EOFError) as e:
+                logger.debug(f"WAV slice unavailable for {target_path.name}, using ffmpeg: {e}")
+        
+        # Trim with ffmpeg and stream the WAV straight to the client
+        # (no full decode into memory; WAV sources are stream-copied without re-encoding)
+        codec_args = ["-c", "copy"] if ext == "wav" else ["-c:a", "pcm_s16le"]
+        cmd = [
+            "ffmpeg", "-hide_banner", "-loglevel", "error",
+            "-ss", str(start_time),
+            "-t", str(max(0.0, end_time - start_time)),
+            "-i", str(target_path),
+            *codec_args,
+            "-f", "wav",
+            "pipe:1"
+        ]
+        # (ffmpeg start-up and the first read block, so they run in the threadpool)
+        stream_output = await run_in_threadpool(_open_ffmpeg_stream, cmd)
+        
+        return StreamingResponse(stream_output, media_type="audio/wav", headers=headers)
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error trimming audio: {e}")
         raise HTTPException(status_code=500, detail=str(e))
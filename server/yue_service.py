@@ -1,12 +1,22 @@
 import os
-import subprocess
+import sys
+import re
+import asyncio
 import threading
 import uuid
 import json
 import logging
 import time
-import glob
-from huggingface_hub import snapshot_download
+import collections
+import shutil
+import sqlite3
+import importlib.util
+
+# Use the Rust hf_transfer backend for the multi-GB model downloads when it is installed
+# (must be set before huggingface_hub is imported)
+if importlib.util.find_spec("hf_transfer") is not None:
+    os.environ.setdefault("HF_HUB_ENABLE_HF_TRANSFER", "1")
+from huggingface_hub import snapshot_download, try_to_load_from_cache
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -20,15 +30,224 @@ VENV_PYTHON = os.path.join(VENV_SCRIPTS, "python.exe")
 INFER_SCRIPT = os.path.join(YUE_DIR, "src", "yue", "infer.py")
 OUTPUT_DIR = os.path.join(os.path.dirname(BASE_DIR), "outputs", "yue_generations")
 
+# Hugging Face hub cache shared by the downloads here and the infer.py subprocess
+# (point it at a shared volume so replicas don't each re-download the models)
+HF_CACHE = (
+    os.environ.get("HUGGINGFACE_HUB_CACHE")
+    or os.environ.get("HF_HUB_CACHE")
+    or (os.path.join(os.environ["HF_HOME"], "hub") if os.environ.get("HF_HOME") else None)
+)
+
 # Ensure output directory exists
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-# In-memory job store (replace with database if needed)
-jobs = {}
+# Stage 1 model per language and EXL2 branch per quality (unknown values fall back to en / fast)
+_STAGE1_REPOS = {
+    "ja": "bartowski/YuE-s1-7B-anneal-jp-kr-cot-exl2",
+    "en": "Doctor-Shotgun/YuE-s1-7B-anneal-en-cot-exl2",
+}
+_REVISIONS = {
+    "best": "8.0bpw-h8",
+    "balanced": "6.0bpw-h6",
+    "fast": "4.25bpw-h6",
+}
+STAGE2_REPO = "Doctor-Shotgun/YuE-s2-1B-general-exl2"
+STAGE2_REVISION = "8.0bpw-h8"  # Only one quality used for now
+
+# infer.py progress output: tqdm counters like "1234/3000 [" and stage segment counters like "1/2"
+_TOK_RE = re.compile(r'(\d+)/(\d+)\s*\[')
+_SEG_RE = re.compile(r'(\d+)/(\d+)')
+
+# tqdm redraws its bars many times a second; progress lines are logged at most this often
+PROGRESS_LOG_INTERVAL = 0.25
+
+# Plain-text markers in infer.py output -> progress (marker, case-insensitive, progress); first match wins
+_PROGRESS_MARKERS = (
+    ("Starting stage 1", False, 10),
+    ("Starting stage 2", False, 50),
+    ("postprocessing", True, 90),
+    ("vocoder", True, 90),
+)
+
+class _TitleTable(dict):
+    """
+    str.translate table for output file titles: spaces become "_", alphanumerics
+    (any script) and "-"/"_" are kept, everything else is dropped.
+    Filled in lazily, one entry per code point seen.
+    """
+    def __missing__(self, codepoint):
+        c = chr(codepoint)
+        value = codepoint if c.isalnum() or c in "-_" else None
+        self[codepoint] = value
+        return value
+
+_TITLE_TABLE = _TitleTable({ord(" "): "_"})
+
+# vocal_type option -> (genre tag to prepend, pattern that finds the tag as whole words)
+# (whole words, so "female vocals" no longer counts as already having "male vocals")
+_VOCAL_TAGS = {
+    vocal_type: (tag, re.compile(rf"(?<!\w){re.escape(tag)}(?!\w)", re.IGNORECASE))
+    for vocal_type, tag in (("none", "instrumental"), ("male", "male vocals"), ("female", "female vocals"))
+}
+
+# Most recent log lines kept per job
+JOB_LOG_MAXLEN = 1000
+
+class Job:
+    """
+    State of one generation job. Written by its worker thread and read by status polls;
+    logs is a bounded deque guarded by _lock so a snapshot never sees it mid-append.
+    Every change to status/progress/error/logs bumps version and wakes wait_for_change().
+    """
+    __slots__ = ("id", "status", "progress", "logs", "output_files", "created_at", "error", "version", "_files_cached_mtime", "_lock", "_changed")
+    
+    def __init__(self, job_id: str):
+        self.id = job_id
+        self.status = "pending"
+        self.progress = 0
+        self.logs = collections.deque(maxlen=JOB_LOG_MAXLEN)
+        self.output_files = []
+        self.created_at = time.time()
+        self.error = None
+        self.version = 0
+        self._files_cached_mtime = None
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+    
+    def _bump(self):
+        # Caller holds _lock
+        self.version += 1
+        self._changed.notify_all()
+    
+    def update(self, **fields):
+        """Set status/progress/error; waiters are only woken if a value actually changed"""
+        with self._lock:
+            changed = False
+            for name, value in fields.items():
+                if getattr(self, name) != value:
+                    setattr(self, name, value)
+                    changed = True
+            if changed:
+                self._bump()
+    
+    def log(self, line: str):
+        with self._lock:
+            self.logs.append(line)
+            self._bump()
+    
+    def wait_for_change(self, since_version: int, timeout: float) -> bool:
+        """Block until version differs from since_version (or timeout); True if it does"""
+        with self._lock:
+            return self._changed.wait_for(lambda: self.version != since_version, timeout)
+    
+    def snapshot(self) -> dict:
+        """Plain-dict copy of the public fields"""
+        with self._lock:
+            return {
+                "id": self.id,
+                "status": self.status,
+                "progress": self.progress,
+                "logs": list(self.logs),
+                "output_files": list(self.output_files),
+                "created_at": self.created_at,
+                "error": self.error,
+                "version": self.version
+            }
+
+# Persisted job records (kept outside OUTPUT_DIR, which is served as static files)
+JOB_DB_PATH = os.getenv("YUE_JOB_DB", os.path.join(BASE_DIR, "yue_jobs.sqlite3"))
+# Days to keep finished jobs and their outputs; 0 keeps them forever
+JOB_RETENTION_DAYS = float(os.getenv("YUE_JOB_RETENTION_DAYS", "0"))
+JOB_CACHE_MAXSIZE = 64
+
+class JobStore:
+    """
+    Job registry. Live Job objects are kept in memory; every job is also written to SQLite
+    when it starts and when it finishes, so finished jobs survive restarts and can be
+    evicted from memory (beyond JOB_CACHE_MAXSIZE) without losing their status.
+    """
+    def __init__(self, db_path: str, cache_maxsize: int = JOB_CACHE_MAXSIZE):
+        self.cache_maxsize = cache_maxsize
+        self._jobs: "collections.OrderedDict[str, Job]" = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, status TEXT, created_at REAL, data TEXT)")
+        self._fail_interrupted()
+    
+    def _fail_interrupted(self):
+        # Jobs that were still running when the server stopped will never finish
+        with self._lock, self._db:
+            rows = self._db.execute("SELECT id, data FROM jobs WHERE status NOT IN ('completed', 'failed')").fetchall()
+            for job_id, data in rows:
+                record = json.loads(data)
+                record.update(status="failed", error="Interrupted by server restart")
+                self._db.execute("UPDATE jobs SET status = ?, data = ? WHERE id = ?", ("failed", json.dumps(record), job_id))
+    
+    def _save(self, job: Job):
+        record = job.snapshot()
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO jobs (id, status, created_at, data) VALUES (?, ?, ?, ?)",
+                (job.id, record["status"], record["created_at"], json.dumps(record))
+            )
+    
+    def add(self, job: Job):
+        with self._lock:
+            self._jobs[job.id] = job
+        self._save(job)
+    
+    def get(self, job_id: str) -> "Job | None":
+        """The in-memory Job, if it is still cached"""
+        with self._lock:
+            return self._jobs.get(job_id)
+    
+    def load(self, job_id: str) -> "dict | None":
+        """The persisted snapshot of a job"""
+        with self._lock:
+            row = self._db.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+    
+    def finish(self, job: Job):
+        """Persist a finished job and evict the oldest finished jobs from memory"""
+        self._save(job)
+        with self._lock:
+            self._jobs.move_to_end(job.id)
+            finished = [j for j in self._jobs.values() if j.status in ("completed", "failed")]
+            for old in finished[:max(0, len(self._jobs) - self.cache_maxsize)]:
+                del self._jobs[old.id]
+    
+    def purge(self, max_age_sec: float):
+        """Delete finished jobs older than max_age_sec, with their output directories"""
+        cutoff = time.time() - max_age_sec
+        with self._lock, self._db:
+            job_ids = [row[0] for row in self._db.execute(
+                "SELECT id FROM jobs WHERE created_at < ? AND status IN ('completed', 'failed')", (cutoff,)
+            )]
+            self._db.executemany("DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id in job_ids])
+            for job_id in job_ids:
+                self._jobs.pop(job_id, None)
+        for job_id in job_ids:
+            shutil.rmtree(os.path.join(OUTPUT_DIR, job_id), ignore_errors=True)
+        if job_ids:
+            logger.info(f"Purged {len(job_ids)} YuE jobs older than {max_age_sec / 86400:g} days")
+
+jobs = JobStore(JOB_DB_PATH)
+
+def _janitor_loop(interval_sec: float = 3600.0):
+    while True:
+        try:
+            jobs.purge(JOB_RETENTION_DAYS * 86400)
+        except Exception as e:
+            logger.warning(f"YuE job purge failed: {e}")
+        time.sleep(interval_sec)
+
+if JOB_RETENTION_DAYS > 0:
+    threading.Thread(target=_janitor_loop, daemon=True).start()
 
 def start_generation_job(genre_txt: str, lyrics_txt: str, options: dict = None):
     """
-    Starts a background thread for YuE music generation.
+    Queues a YuE music generation job for the worker pool.
     """
     if options is None:
         options = {}
@@ -38,17 +257,9 @@ def start_generation_job(genre_txt: str, lyrics_txt: str, options: dict = None):
     os.makedirs(job_dir, exist_ok=True)
     
     # Process vocal style - avoid adding duplicates
-    vocal_type = options.get("vocal_type", "female")
-    genre_txt_lower = genre_txt.lower()
-    if vocal_type == "none":
-        if "instrumental" not in genre_txt_lower:
-            genre_txt = "instrumental, " + genre_txt
-    elif vocal_type == "male":
-        if "male vocals" not in genre_txt_lower:
-            genre_txt = "male vocals, " + genre_txt
-    elif vocal_type == "female":
-        if "female vocals" not in genre_txt_lower:
-            genre_txt = "female vocals, " + genre_txt
+    vocal_tag = _VOCAL_TAGS.get(options.get("vocal_type", "female"))
+    if vocal_tag and not vocal_tag[1].search(genre_txt):
+        genre_txt = f"{vocal_tag[0]}, " + genre_txt
 
     # Save prompts to files (required by CLI)
     genre_file = os.path.join(job_dir, "genre.txt")
@@ -60,50 +271,148 @@ def start_generation_job(genre_txt: str, lyrics_txt: str, options: dict = None):
     with open(lyrics_file, "w", encoding="utf-8") as f:
         f.write(lyrics_txt)
         
-    jobs[job_id] = {
-        "id": job_id,
-        "status": "pending",
-        "progress": 0,
-        "logs": [],
-        "output_files": [],
-        "created_at": time.time(),
-        "error": None
-    }
+    job = Job(job_id)
+    job.update(status="queued")
+    jobs.add(job)
     
-    # Start background processing
-    thread = threading.Thread(
-        target=_run_yue_process, 
-        args=(job_id, job_dir, genre_file, lyrics_file, options),
-        daemon=True
-    )
-    thread.start()
+    # Hand off to the job loop; it runs once a slot is free (FIFO)
+    asyncio.run_coroutine_threadsafe(_run_queued_job(job_id, job_dir, genre_file, lyrics_file, options), _loop)
     
     return job_id
 
+def queue_depth() -> int:
+    """Number of jobs waiting for a free slot"""
+    return _queued_count
+
+# Audio files the generator writes into a job directory
+OUTPUT_EXTENSIONS = (".mp3", ".wav")
+
+def _list_output_files(job_dir: str):
+    """Names of the generated audio files in job_dir (one readdir)"""
+    with os.scandir(job_dir) as it:
+        return sorted(e.name for e in it if e.name.endswith(OUTPUT_EXTENSIONS))
+
 def get_job_status(job_id: str):
     """
     Returns the current status of a job.
     """
-    if job_id not in jobs:
-        return None
+    job = jobs.get(job_id)
+    if job is None:
+        # Finished earlier (possibly before a restart) and no longer held in memory
+        return jobs.load(job_id)
         
     # Check for output files if job is done (or even if running)
-    job = jobs[job_id]
     job_dir = os.path.join(OUTPUT_DIR, job_id)
     
-    # Update output files list
-    if os.path.exists(job_dir):
-        files = glob.glob(os.path.join(job_dir, "*.mp3")) + glob.glob(os.path.join(job_dir, "*.wav"))
-        job["output_files"] = [os.path.basename(f) for f in files]
+    # Update output files list; once the job has finished the listing only
+    # changes if the directory does, so polls skip the rescan
+    try:
+        mtime_ns = os.stat(job_dir).st_mtime_ns
+    except FileNotFoundError:
+        return job.snapshot()
+    if job.status not in ("completed", "failed") or job._files_cached_mtime != mtime_ns:
+        job.output_files = _list_output_files(job_dir)
+        job._files_cached_mtime = mtime_ns
         
-    return job
+    return job.snapshot()
 
-def _run_yue_process(job_id, job_dir, genre_file, lyrics_file, options):
+def get_job_status_wait(job_id: str, since_version: int = None, timeout: float = 30.0):
+    """
+    Long-poll variant of get_job_status: when since_version is given, blocks until the job
+    has changed since that version (or timeout seconds pass), then returns its status.
+    Clients pass the "version" of their previous response, so they are only woken by real changes.
+    """
+    job = jobs.get(job_id)
+    if job is not None and since_version is not None:
+        job.wait_for_change(since_version, timeout)
+    return get_job_status(job_id)
+
+# EXL2 weight shards: "output-00001-of-00003.safetensors"
+_SHARD_RE = re.compile(r'^(.*)-(\d+)-of-(\d+)\.safetensors$')
+
+def _snapshot_complete(snapshot_dir: str) -> bool:
+    """
+    Whether a cached snapshot holds all of its weights: every file named in a safetensors
+    index, every shard of each "-NNNNN-of-MMMMM" set, and at least one .safetensors file.
+    (The hub creates the snapshot folder as soon as its first file lands, so an interrupted
+    download leaves a partial one behind.)
+    """
+    try:
+        names = set(os.listdir(snapshot_dir))
+    except OSError:
+        return False
+    for name in names:
+        if name.endswith(".safetensors.index.json"):
+            try:
+                with open(os.path.join(snapshot_dir, name), encoding="utf-8") as f:
+                    weight_map = json.load(f).get("weight_map", {})
+            except (OSError, ValueError):
+                return False
+            if not set(weight_map.values()) <= names:
+                return False
+    shard_sets = {}
+    for name in names:
+        m = _SHARD_RE.match(name)
+        if m:
+            shard_sets.setdefault((m.group(1), m.group(3)), set()).add(int(m.group(2)))
+    for (_, total), seen in shard_sets.items():
+        if seen != set(range(1, int(total) + 1)):
+            return False
+    return any(name.endswith(".safetensors") for name in names)
+
+def _ensure_snapshot(repo_id: str, revision: str) -> str:
+    """
+    snapshot_download, but when the revision is already fully in the local cache resolve it
+    offline instead of re-validating every file against the Hub. A partial snapshot (e.g. an
+    interrupted first download) goes through the online call, which fetches the missing files.
+    """
+    if isinstance(try_to_load_from_cache(repo_id, "config.json", cache_dir=HF_CACHE, revision=revision), str):
+        try:
+            path = snapshot_download(repo_id=repo_id, revision=revision, cache_dir=HF_CACHE, local_files_only=True)
+            if _snapshot_complete(path):
+                return path
+            logger.info(f"Cached snapshot of {repo_id} ({revision}) is incomplete, resuming download")
+        except Exception as e:
+            logger.debug(f"Cached snapshot of {repo_id} ({revision}) unusable, downloading: {e}")
+    return snapshot_download(repo_id=repo_id, revision=revision, cache_dir=HF_CACHE)
+
+# Bytes per os.read() of the infer.py output pipe
+PIPE_READ_SIZE = 64 * 1024
+
+async def _aiter_output_lines(stream: asyncio.StreamReader):
+    """
+    Yield the non-empty lines read from a subprocess pipe until EOF, PIPE_READ_SIZE bytes at a time.
+    Both "\n" and the "\r" of tqdm redraws end a line; lines are decoded as UTF-8 (invalid bytes replaced).
+    """
+    pending = b""
+    while True:
+        chunk = await stream.read(PIPE_READ_SIZE)
+        if not chunk:
+            break
+        lines = (pending + chunk).replace(b"\r", b"\n").split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            if line:
+                yield line.decode("utf-8", errors="replace")
+    if pending:
+        yield pending.decode("utf-8", errors="replace")
+
+async def _run_yue_process(job_id, job_dir, genre_file, lyrics_file, options):
     """
     Executes the YuE inference script in a subprocess.
+    Runs on the job loop: pipe reads wait on the loop instead of holding a thread per job.
     """
-    job = jobs[job_id]
-    job["status"] = "processing"
+    loop = asyncio.get_running_loop()
+    job = jobs.get(job_id)
+    job.update(status="processing")
+    
+    # Options
+    quality = options.get("quality", "fast")
+    language = options.get("language", "en")
+    stage2_repo_id = options.get("stage2_model", STAGE2_REPO)
+    segments = options.get("segments", 2)
+    max_new_tokens = options.get("max_new_tokens", 3000)
+    title = options.get("title", "My Song")
     
     try:
         # Prepare environment
@@ -111,49 +420,34 @@ def _run_yue_process(job_id, job_dir, genre_file, lyrics_file, options):
         env = os.environ.copy()
         env["PATH"] = VENV_SCRIPTS + os.pathsep + env["PATH"]
         env["VIRTUAL_ENV"] = os.path.join(YUE_DIR, "venv")
-        
-        # Prepare arguments
-        quality = options.get("quality", "fast")
-        language = options.get("language", "en")
+        if HF_CACHE:
+            env["HF_HUB_CACHE"] = HF_CACHE
         
         # Mapping to quantized branches/models
-        if language == "ja":
-            repo_id = "bartowski/YuE-s1-7B-anneal-jp-kr-cot-exl2"
-            if quality == "best":
-                revision = "8.0bpw-h8"
-            elif quality == "balanced":
-                revision = "6.0bpw-h6"
-            else:
-                revision = "4.25bpw-h6"
-        else:
-            repo_id = "Doctor-Shotgun/YuE-s1-7B-anneal-en-cot-exl2"
-            if quality == "best":
-                revision = "8.0bpw-h8"
-            elif quality == "balanced":
-                revision = "6.0bpw-h6"
-            else:
-                revision = "4.25bpw-h6"
-
-        # Download/Cache Stage 1 Model
-        job["logs"].append(f"Using {language.upper()} focus model: {repo_id} ({revision})")
-        job["logs"].append(f"Downloading Stage 1 model ({revision})... This may take several minutes on first run.")
-        job["progress"] = 2
-        logger.info(f"Ensuring Stage 1 model {repo_id} (rev: {revision}) is available...")
-        stage1_model_path = snapshot_download(repo_id=repo_id, revision=revision)
-        job["logs"].append(f"Stage 1 model ready: {stage1_model_path}")
-        job["progress"] = 5
+        repo_id = _STAGE1_REPOS.get(language, _STAGE1_REPOS["en"])
+        revision = _REVISIONS.get(quality, _REVISIONS["fast"])
+        stage2_revision = STAGE2_REVISION
         
-        # Download/Cache Stage 2 Model (only one quality used for now)
-        stage2_repo_id = options.get("stage2_model", "Doctor-Shotgun/YuE-s2-1B-general-exl2")
-        stage2_revision = "8.0bpw-h8"
-        job["logs"].append(f"Downloading Stage 2 model ({stage2_revision})...")
+        # Download/Cache Stage 1 and Stage 2 Models
+        # (independent repos, so both downloads run at the same time)
+        job.log(f"Using {language.upper()} focus model: {repo_id} ({revision})")
+        job.log(f"Downloading Stage 1 model ({revision}) and Stage 2 model ({stage2_revision})... This may take several minutes on first run.")
+        job.update(progress=2)
+        logger.info(f"Ensuring Stage 1 model {repo_id} (rev: {revision}) is available...")
         logger.info(f"Ensuring Stage 2 model {stage2_repo_id} (rev: {stage2_revision}) is available...")
-        stage2_model_path = snapshot_download(repo_id=stage2_repo_id, revision=stage2_revision)
-        job["logs"].append(f"Stage 2 model ready: {stage2_model_path}")
-        job["progress"] = 8
+        # (blocking downloads run in the loop's default thread pool)
+        stage1_future = loop.run_in_executor(None, _ensure_snapshot, repo_id, revision)
+        stage2_future = loop.run_in_executor(None, _ensure_snapshot, stage2_repo_id, stage2_revision)
+        # If Stage 1 fails the job fails right away; retrieve Stage 2's exception whenever it
+        # finishes so it isn't reported as "never retrieved"
+        stage2_future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        stage1_model_path = await stage1_future
+        job.log(f"Stage 1 model ready: {stage1_model_path}")
+        job.update(progress=5)
         
-        segments = options.get("segments", 2)
-        max_new_tokens = options.get("max_new_tokens", 3000)
+        stage2_model_path = await stage2_future
+        job.log(f"Stage 2 model ready: {stage2_model_path}")
+        job.update(progress=8)
         
         cmd = [
             VENV_PYTHON,
@@ -174,83 +468,149 @@ def _run_yue_process(job_id, job_dir, genre_file, lyrics_file, options):
             "--cuda_idx", "0"
         ]
         
-        # Log command
-        logger.info(f"Starting YuE job {job_id} with command: {' '.join(cmd)}")
-        job["logs"].append(f"Command: {' '.join(cmd)}")
+        # Log command (joined once; the job log always needs it, the logger only if INFO is enabled)
+        command_line = " ".join(cmd)
+        logger.info("Starting YuE job %s with command: %s", job_id, command_line)
+        job.log(f"Command: {command_line}")
         
         # Execute
-        process = subprocess.Popen(
-            cmd,
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
             cwd=YUE_DIR, 
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            env=env,
-            text=True,
-            encoding='utf-8',
-            errors='replace'
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            env=env
         )
         
         # Stream logs
-        for line in process.stdout:
+        last_progress_log = 0.0
+        async for line in _aiter_output_lines(process.stdout):
             line = line.strip()
             if line:
-                logger.info(f"[YuE {job_id}] {line}")
-                job["logs"].append(line)
-                
                 # Improved Progress parsing
-                import re
-                token_match = re.search(r'(\d+)/(\d+)\s*\[', line)
+                token_match = _TOK_RE.search(line) if "/" in line else None
                 if token_match:
                     current = int(token_match.group(1))
                     total = int(token_match.group(2))
                     
-                    if "50%|##### | 1/2" in line or "100%|##########| 2/2" in line or "/2 [" in line:
-                         seg_match = re.search(r'(\d+)/(\d+)', line)
+                    # Progress stays live; the log only gets throttled samples (and each bar's last update)
+                    now = time.monotonic()
+                    if current == total or now - last_progress_log >= PROGRESS_LOG_INTERVAL:
+                        last_progress_log = now
+                        logger.info(f"[YuE {job_id}] {line}")
+                        job.log(line)
+                    
+                    # Segment bar ("1/2 [", "2/2 [")
+                    if "/2 [" in line:
+                         seg_match = _SEG_RE.search(line)
                          if seg_match:
                              c_seg = int(seg_match.group(1))
                              t_seg = int(seg_match.group(2))
                              progress = 50 + int((c_seg / t_seg) * 40)
-                             job["progress"] = min(progress, 90)
+                             job.update(progress=min(progress, 90))
                     else:
                         progress = 10 + int((current / total) * 40)
-                        job["progress"] = min(progress, 50)
-                elif "Starting stage 1" in line:
-                    job["progress"] = 10
-                elif "Starting stage 2" in line:
-                    job["progress"] = 50
-                elif "postprocessing" in line.lower() or "vocoder" in line.lower():
-                    job["progress"] = 90
+                        job.update(progress=min(progress, 50))
+                else:
+                    logger.info(f"[YuE {job_id}] {line}")
+                    job.log(line)
+                    
+                    # Lowercase the line at most once, and only if a case-insensitive marker is reached
+                    lowered = None
+                    for marker, ignore_case, marker_progress in _PROGRESS_MARKERS:
+                        if ignore_case:
+                            if lowered is None:
+                                lowered = line.lower()
+                            found = marker in lowered
+                        else:
+                            found = marker in line
+                        if found:
+                            job.update(progress=marker_progress)
+                            break
         
-        process.wait()
+        await process.wait()
         
         if process.returncode == 0:
-            job["status"] = "completed"
-            job["progress"] = 100
-            
             # Rename files with title
-            title = options.get("title", "My Song").replace(" ", "_")
-            title = "".join([c for c in title if c.isalnum() or c in ('-', '_')]).rstrip()
+            title = title.translate(_TITLE_TABLE)
             
-            job_dir_files = glob.glob(os.path.join(job_dir, "*.mp3")) + glob.glob(os.path.join(job_dir, "*.wav"))
-            for fpath in job_dir_files:
-                fname = os.path.basename(fpath)
+            # One readdir; DirEntry.is_file() uses the cached d_type, so no stat per file
+            with os.scandir(job_dir) as it:
+                job_dir_files = [e for e in it if e.is_file(follow_symlinks=False) and e.name.endswith(OUTPUT_EXTENSIONS)]
+            for entry in job_dir_files:
+                fname = entry.name
                 if not fname.startswith(title):
                     new_name = f"{title}_{fname}"
                     new_path = os.path.join(job_dir, new_name)
                     try:
-                        os.rename(fpath, new_path)
+                        os.rename(entry.path, new_path)
                         logger.info(f"Renamed {fname} to {new_name}")
                     except Exception as e:
                         logger.warning(f"Failed to rename {fname}: {e}")
-
-            job["logs"].append("Generation completed successfully.")
+            
+            # Publish "completed" only once the final names are listed: it wakes long-pollers,
+            # which stop polling and would otherwise keep the pre-rename file names
+            job.update(output_files=_list_output_files(job_dir), status="completed", progress=100)
+            job.log("Generation completed successfully.")
         else:
-            job["status"] = "failed"
-            job["error"] = f"Process exited with code {process.returncode}"
-            job["logs"].append(f"FAILED: Process exited with code {process.returncode}")
+            job.update(status="failed", error=f"Process exited with code {process.returncode}")
+            job.log(f"FAILED: Process exited with code {process.returncode}")
             
     except Exception as e:
         logger.error(f"Error in YuE job {job_id}: {str(e)}")
-        job["status"] = "failed"
-        job["error"] = str(e)
-        job["logs"].append(f"EXCEPTION: {str(e)}")
+        job.update(status="failed", error=str(e))
+        job.log(f"EXCEPTION: {str(e)}")
+    finally:
+        # Record the final file list with the persisted job
+        try:
+            job.output_files = _list_output_files(job_dir)
+        except OSError:
+            pass
+        jobs.finish(job)
+
+
+# Job loop: one event-loop thread drives every job's subprocess and log pipe.
+# Each job runs a GPU-heavy subprocess, so only YUE_WORKERS run at once (one per GPU)
+# and the rest wait, in order, for a slot instead of thrashing the GPU
+YUE_WORKERS = int(os.getenv("YUE_WORKERS", "1"))
+# (the Proactor loop is the Windows loop with subprocess support, whatever the process-wide policy is)
+_loop = asyncio.ProactorEventLoop() if sys.platform == "win32" else asyncio.new_event_loop()
+_job_slots: "asyncio.Semaphore | None" = None  # Created on the job loop
+_queued_count = 0  # Only touched on the job loop
+
+async def _run_queued_job(*args):
+    global _job_slots, _queued_count
+    if _job_slots is None:
+        _job_slots = asyncio.Semaphore(YUE_WORKERS)
+    _queued_count += 1
+    try:
+        await _job_slots.acquire()
+    finally:
+        _queued_count -= 1
+    try:
+        await _run_yue_process(*args)
+    except Exception as e:
+        logger.error(f"YuE job loop error: {e}")
+    finally:
+        _job_slots.release()
+
+threading.Thread(target=_loop.run_forever, name="yue-jobs", daemon=True).start()
+
+
+# Optionally fetch the default models in the background at import time, so the first
+# job doesn't sit at 2-8% while multiple GB download (the Stage 1 quality is YUE_WARMUP_QUALITY)
+_WARMUP_PAIRS = tuple(
+    (repo_id, _REVISIONS.get(os.getenv("YUE_WARMUP_QUALITY", "fast"), _REVISIONS["fast"]))
+    for repo_id in _STAGE1_REPOS.values()
+) + ((STAGE2_REPO, STAGE2_REVISION),)
+
+def _warmup():
+    for repo_id, revision in _WARMUP_PAIRS:
+        try:
+            logger.info(f"Warming up YuE model cache: {repo_id} ({revision})")
+            _ensure_snapshot(repo_id, revision)
+        except Exception as e:
+            logger.warning(f"YuE warm-up download failed for {repo_id} ({revision}): {e}")
+
+if os.getenv("YUE_EAGER_DOWNLOAD") == "1":
+    threading.Thread(target=_warmup, daemon=True).start()
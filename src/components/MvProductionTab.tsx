@@ -23,9 +23,9 @@ interface TaskState {
 type TrackType = 'original' | 'vocals' | 'instrumental';
 
 // Audio Analysis Types
-interface IntensityPoint {
-    time: number;
-    value: number;
+interface IntensityCurve {
+    times: number[];
+    values: number[];
 }
 
 interface AudioSegment {
@@ -40,8 +40,9 @@ interface AudioAnalysis {
     duration?: number;
     bpm?: number;
     key?: string;
-    intensity_curve?: IntensityPoint[];
+    intensity_curve?: IntensityCurve;
     segments?: AudioSegment[];
+    truncated?: boolean;
     error?: string;
 }
 
@@ -990,7 +991,7 @@ const MvProductionTab: React.FC = () => {
                         <div className="grid grid-cols-2 gap-4">
                             <a
                                 href={state.result?.vocals_url ? `http://localhost:8000${state.result.vocals_url}` : '#'}
-                                onClick={(e) => state.result?.vocals_url && handleDownloadFile(e, `http://localhost:8000${state.result.vocals_url}`, 'vocals.wav')}
+                                onClick={(e) => state.result?.vocals_url && handleDownloadFile(e, `http://localhost:8000${state.result.vocals_url}`, state.result.vocals_url.split('/').pop() || 'vocals.wav')}
                                 className={`flex items-center justify-between p-4 bg-indigo-500/5 border border-indigo-500/10 rounded-2xl hover:bg-indigo-500/10 hover:border-indigo-500/30 transition-all text-indigo-300 group cursor-pointer ${isDownloading ? 'opacity-50 pointer-events-none' : ''}`}
                             >
                                 <span className="flex items-center gap-2 font-bold text-sm">
@@ -1000,7 +1001,7 @@ const MvProductionTab: React.FC = () => {
                             </a>
                             <a
                                 href={state.result?.instrumental_url ? `http://localhost:8000${state.result.instrumental_url}` : '#'}
-                                onClick={(e) => state.result?.instrumental_url && handleDownloadFile(e, `http://localhost:8000${state.result.instrumental_url}`, 'instrumental.wav')}
+                                onClick={(e) => state.result?.instrumental_url && handleDownloadFile(e, `http://localhost:8000${state.result.instrumental_url}`, state.result.instrumental_url.split('/').pop() || 'instrumental.wav')}
                                 className={`flex items-center justify-between p-4 bg-violet-500/5 border border-violet-500/10 rounded-2xl hover:bg-violet-500/10 hover:border-violet-500/30 transition-all text-violet-300 group cursor-pointer ${isDownloading ? 'opacity-50 pointer-events-none' : ''}`}
                             >
                                 <span className="flex items-center gap-2 font-bold text-sm">